@@ -4,18 +4,22 @@ LLOgen Backend - FastAPI service for generating llms.txt files
 
 import os
 import json
+import hashlib
 import logging
+import re
 from typing import Optional, Dict, Any, List
-from urllib.parse import urljoin, urlparse
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
 import asyncio
 from datetime import datetime
 
 import httpx
 import trafilatura
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from cachetools import LRUCache, TTLCache
 import google.generativeai as genai
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, HttpUrl
 from dotenv import load_dotenv
 
@@ -34,7 +38,8 @@ else:
     genai.configure(api_key=GEMINI_API_KEY)
 
 # FastAPI app
-app = FastAPI(title="LLOgen API", version="1.0.0")
+# ORJSONResponse keeps serialization cheap for the frequently polled status endpoint
+app = FastAPI(title="LLOgen API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -67,7 +72,45 @@ class GenerationStatus(BaseModel):
     message: str = ""
 
 # In-memory storage for generation status (in production, use Redis or database)
-generation_status = {}
+# Bounded so old generations are evicted instead of accumulating forever
+generation_status = LRUCache(maxsize=1024)
+
+# Held for the lifetime of a generation so each site is only crawled once at a time
+_url_locks: Dict[str, asyncio.Lock] = {}
+
+# Extracted page content keyed by URL, shared across crawls
+_PAGE_CACHE = TTLCache(maxsize=2048, ttl=600)
+
+# Generated llms.txt keyed by a hash of the request, so identical requests skip Gemini
+_RESULT_CACHE = TTLCache(maxsize=256, ttl=3600)
+
+# Per-page download cap; larger bodies are truncated rather than held in memory
+MAX_PAGE_BYTES = 2_000_000
+
+# Rough character limit for site content included in the Gemini prompt
+MAX_PROMPT_CHARS = 100_000
+
+# Link filters used during page discovery
+_SKIP_HREF_PREFIX = ('#', 'mailto:', 'tel:', 'javascript:')
+_SKIP_EXT = re.compile(r'\.(?:pdf|jpe?g|png|gif|css|js|xml|json)$', re.IGNORECASE)
+_SKIP_PREFIX = ('/api/', '/admin/', '/_')
+_LINK_STRAINER = SoupStrainer('a', href=True)
+_TRACKING_PARAMS = frozenset(('fbclid', 'gclid'))
+
+def _canon(u: str) -> str:
+    """Normalize a URL so trivially different spellings of a page dedupe"""
+    parts = urlsplit(u)
+    query = parts.query
+    if query:
+        pairs = parse_qsl(query, keep_blank_values=True)
+        kept = [(k, v) for k, v in pairs if not k.startswith('utm_') and k not in _TRACKING_PARAMS]
+        # Only re-encode when something was dropped, so untouched queries keep their spelling
+        if len(kept) != len(pairs):
+            query = urlencode(kept)
+    path = parts.path or '/'
+    if path != '/' and path.endswith('/'):
+        path = path[:-1]
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ''))
 
 class WebScraper:
     """Web scraping utility class"""
@@ -76,24 +119,59 @@ class WebScraper:
         self.max_pages = max_pages
         self.timeout = timeout
         self.session = None
+        self._prefetched: Dict[str, bytes] = {}  # Raw HTML already fetched during discovery
     
     async def __aenter__(self):
-        self.session = httpx.AsyncClient(timeout=self.timeout)
+        # The connection pool caps concurrency; HTTP/2 multiplexes pages from the same host.
+        # No pool timeout, so requests beyond the limit queue for a slot instead of failing.
+        self.session = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.timeout, pool=None),
+            http2=True,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        )
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._prefetched.clear()
         if self.session:
             await self.session.aclose()
     
+    async def fetch_html(self, url: str) -> bytes:
+        """Download a page body, stopping once MAX_PAGE_BYTES have been read"""
+        async with self.session.stream("GET", url, follow_redirects=True) as response:
+            response.raise_for_status()
+            logger.debug(f"{url} content-encoding: {response.headers.get('content-encoding', 'identity')}")
+            buf = bytearray()
+            async for chunk in response.aiter_bytes():
+                buf.extend(chunk)
+                if len(buf) >= MAX_PAGE_BYTES:
+                    logger.warning(f"Truncating {url} at {MAX_PAGE_BYTES} bytes")
+                    del buf[MAX_PAGE_BYTES:]
+                    break
+            return bytes(buf)
+    
     async def get_page_content(self, url: str) -> Optional[str]:
         """Fetch and extract content from a single page"""
+        cached = _PAGE_CACHE.get(url)
+        if cached is not None:
+            return cached
+        
         try:
-            logger.info(f"Fetching: {url}")
-            response = await self.session.get(url, follow_redirects=True)
-            response.raise_for_status()
+            html = self._prefetched.pop(url, None)
+            if html is None:
+                logger.info(f"Fetching: {url}")
+                html = await self.fetch_html(url)
             
-            # Use trafilatura for content extraction
-            content = trafilatura.extract(response.text, include_comments=False, include_tables=True)
+            # Use trafilatura for content extraction, off the event loop since it is CPU-bound
+            content = await asyncio.to_thread(
+                trafilatura.extract,
+                html,
+                include_comments=False,
+                include_tables=True,
+                no_fallback=True,
+            )
+            if content:
+                _PAGE_CACHE[url] = content
             return content
         except Exception as e:
             logger.error(f"Error fetching {url}: {str(e)}")
@@ -101,43 +179,58 @@ class WebScraper:
     
     async def discover_pages(self, base_url: str, whitelist_domains: List[str] = None) -> List[str]:
         """Discover pages to crawl from the website"""
-        pages = set([base_url])  # Always include the base URL
+        # Relative links resolve against the URL as submitted; pages are keyed canonically
+        base_key = _canon(base_url)
+        pages = set([base_key])  # Always include the base URL
         
         try:
-            response = await self.session.get(base_url, follow_redirects=True)
-            response.raise_for_status()
+            html = await self.fetch_html(base_url)
+            self._prefetched[base_key] = html
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            base_domain = urlparse(base_url).netloc
+            # lxml is already required by trafilatura; only build <a href> nodes
+            soup = BeautifulSoup(html, 'lxml', parse_only=_LINK_STRAINER)
+            base_parts = urlsplit(base_url)
+            base_domain = base_parts.netloc.lower()
+            base_scheme = base_parts.scheme
             
             # Find all links
             for link in soup.find_all('a', href=True):
                 href = link['href'].strip()
-                if not href:
+                # Skip empty, in-page and non-HTTP links before paying for URL parsing
+                if not href or href.startswith(_SKIP_HREF_PREFIX):
                     continue
                     
-                full_url = urljoin(base_url, href)
-                parsed = urlparse(full_url)
+                # Absolute and protocol-relative links need no resolution
+                if href.startswith(('http://', 'https://')):
+                    full_url = href
+                elif href.startswith('//'):
+                    full_url = f"{base_scheme}:{href}"
+                else:
+                    full_url = urljoin(base_url, href)
+                parsed = urlsplit(full_url)
+                
+                netloc = parsed.netloc.lower()
                 
                 # Filter by domain and file types
-                if (parsed.netloc == base_domain or 
-                    (whitelist_domains and parsed.netloc in whitelist_domains) or 
-                    parsed.netloc == ''):  # Relative URLs
+                if (netloc == base_domain or 
+                    (whitelist_domains and netloc in whitelist_domains) or 
+                    netloc == ''):  # Relative URLs
                     
-                    # Skip anchors, files, and certain paths
-                    if (not parsed.fragment and 
-                        not parsed.path.endswith(('.pdf', '.jpg', '.png', '.gif', '.css', '.js', '.xml', '.json')) and
-                        not parsed.path.startswith(('/api/', '/admin/', '/_'))):
-                        pages.add(full_url)
+                    # Skip files and certain paths (fragments are dropped by _canon)
+                    if (not _SKIP_EXT.search(parsed.path) and
+                        not parsed.path.startswith(_SKIP_PREFIX)):
+                        pages.add(_canon(full_url))
             
             # Limit to max_pages but ensure we have at least the base page
-            pages_list = list(pages)[:self.max_pages]
+            # Base URL goes first so its prefetched HTML is always consumed
+            pages.discard(base_key)
+            pages_list = [base_key, *pages][:self.max_pages]
             logger.info(f"Discovered {len(pages_list)} pages to crawl")
             return pages_list
             
         except Exception as e:
             logger.error(f"Error discovering pages from {base_url}: {str(e)}")
-            return [base_url]  # Fallback to just the main page
+            return [base_key]  # Fallback to just the main page
     
     async def scrape_website(self, base_url: str, whitelist_domains: List[str] = None) -> Dict[str, Any]:
         """Scrape entire website and return structured content"""
@@ -156,19 +249,15 @@ class WebScraper:
             "extracted_at": datetime.now().isoformat()
         }
         
-        # Process pages concurrently (with semaphore to limit concurrent requests)
-        semaphore = asyncio.Semaphore(5)  # Limit to 5 concurrent requests
-        
+        # Process pages concurrently (the client's connection pool limits parallelism)
         async def process_page(url):
-            async with semaphore:
-                content = await self.get_page_content(url)
-                if content:
-                    return {
-                        "url": url,
-                        "content": content,
-                        "word_count": len(content.split()) if content else 0
-                    }
-                return None
+            content = await self.get_page_content(url)
+            if content:
+                return {
+                    "url": url,
+                    "content": content
+                }
+            return None
         
         tasks = [process_page(url) for url in pages]
         results = await asyncio.gather(*tasks, return_exceptions=True)
@@ -183,8 +272,7 @@ class WebScraper:
             logger.warning("No content extracted, adding minimal base page entry")
             site_content["pages"].append({
                 "url": base_url,
-                "content": f"Website: {base_url}\nNo content could be extracted from this website.",
-                "word_count": 10
+                "content": f"Website: {base_url}\nNo content could be extracted from this website."
             })
         
         logger.info(f"Successfully extracted content from {len(site_content['pages'])} pages")
@@ -201,17 +289,20 @@ class LLMSGenerator:
     def create_prompt(self, site_content: Dict[str, Any], config: GeneratorRequest) -> str:
         """Create the prompt for Gemini AI"""
         
-        # Combine all page content
+        # Combine page content, stopping at the limit (Gemini has token limits)
         all_content = []
+        total = 0
         for page in site_content["pages"]:
-            all_content.append(f"=== PAGE: {page['url']} ===\n{page['content']}\n")
+            chunk = f"=== PAGE: {page['url']} ===\n{page['content']}\n"
+            remaining = MAX_PROMPT_CHARS - total
+            if len(chunk) > remaining:
+                all_content.append(chunk[:max(remaining, 0)] + "\n[CONTENT TRUNCATED]")
+                break
+            all_content.append(chunk)
+            total += len(chunk) + 1  # Account for the joining newline
         
         combined_content = "\n".join(all_content)
         
-        # Truncate if too long (Gemini has token limits)
-        if len(combined_content) > 100000:  # Rough character limit
-            combined_content = combined_content[:100000] + "\n[CONTENT TRUNCATED]"
-        
         prompt = f"""You are an expert web content analyzer tasked with generating a standards-compliant llms.txt file for a website. The llms.txt format is designed to help Large Language Models understand and interact with websites more effectively.
 
 **Input Data:**
@@ -280,35 +371,52 @@ Generate ONLY the llms.txt content in plain text format without any explanations
     
     async def generate_llms_txt(self, site_content: Dict[str, Any], config: GeneratorRequest) -> str:
         """Generate llms.txt content using Gemini AI"""
+        site_url = str(config.siteUrl)
         try:
-            update_status(config.siteUrl, "running", "summarize", 60, "Analyzing content with Gemini AI...")
+            update_status(site_url, "running", "summarize", 60, "Analyzing content with Gemini AI...")
             
             prompt = self.create_prompt(site_content, config)
             
-            # Generate content with Gemini
-            response = await asyncio.to_thread(
-                self.model.generate_content,
+            # Stream content from Gemini so progress reflects actual output
+            max_output_tokens = 4000
+            expected_chars = max_output_tokens * 4  # Rough chars-per-token estimate
+            response = await self.model.generate_content_async(
                 prompt,
+                stream=True,
                 generation_config=genai.types.GenerationConfig(
                     temperature=0.3,
-                    max_output_tokens=4000,
+                    max_output_tokens=max_output_tokens,
                 )
             )
             
-            if not response.text:
-                raise Exception("Gemini AI returned empty response")
+            chunks = []
+            received = 0
+            async for chunk in response:
+                if not chunk.parts:
+                    continue
+                chunks.append(chunk.text)
+                received += len(chunk.text)
+                progress = 60 + min(25, received * 25 // expected_chars)
+                update_status(site_url, "running", "compose", progress, "Composing llms.txt...")
             
-            update_status(config.siteUrl, "running", "compose", 80, "Composing final llms.txt...")
+            text = "".join(chunks).strip()
+            if not text:
+                raise Exception("Gemini AI returned empty response")
             
-            return response.text.strip()
+            return text
             
         except Exception as e:
             logger.error(f"Error generating llms.txt: {str(e)}")
             raise HTTPException(status_code=500, detail=f"Failed to generate llms.txt: {str(e)}")
 
+def _status_key(site_url: str) -> str:
+    """Normalize a site URL into its generation_status key"""
+    parts = urlsplit(site_url)
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}{parts.path.rstrip('/') or '/'}"
+
 def update_status(site_url: str, status: str, step: str, progress: int, message: str = ""):
     """Update generation status"""
-    generation_status[site_url] = {
+    generation_status[_status_key(site_url)] = {
         "status": status,
         "step": step,
         "progress": progress,
@@ -316,17 +424,30 @@ def update_status(site_url: str, status: str, step: str, progress: int, message:
         "timestamp": datetime.now().isoformat()
     }
 
+def result_cache_key(config: GeneratorRequest) -> str:
+    """Hash the request config into a result cache key"""
+    payload = json.dumps(config.model_dump(mode="json"), sort_keys=True)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
 async def generate_llms_background(config: GeneratorRequest):
     """Background task to generate llms.txt"""
     site_url = str(config.siteUrl)
+    cache_key = result_cache_key(config)
     
     try:
+        cached = _RESULT_CACHE.get(cache_key)
+        if cached is not None:
+            update_status(site_url, "completed", "done", 100, "Generation completed successfully (cached)")
+            generation_status[_status_key(site_url)]["content"] = cached
+            logger.info(f"Served cached llms.txt for {site_url}")
+            return
+        
         update_status(site_url, "running", "start", 0, "Starting generation...")
         
         # Parse whitelist domains
         whitelist_domains = []
         if config.whitelistDomains:
-            whitelist_domains = [d.strip() for d in config.whitelistDomains.split(",")]
+            whitelist_domains = [d.strip().lower() for d in config.whitelistDomains.split(",")]
         
         # Scrape website
         async with WebScraper(max_pages=config.maxPages) as scraper:
@@ -343,13 +464,14 @@ async def generate_llms_background(config: GeneratorRequest):
             raise Exception("Generated content is too short")
         
         # Store result
-        generation_status[site_url].update({
+        generation_status[_status_key(site_url)].update({
             "status": "completed",
             "step": "done",
             "progress": 100,
             "message": "Generation completed successfully",
             "content": llms_content
         })
+        _RESULT_CACHE[cache_key] = llms_content
         
         logger.info(f"Successfully generated llms.txt for {site_url}")
         
@@ -357,6 +479,14 @@ async def generate_llms_background(config: GeneratorRequest):
         logger.error(f"Error in background generation for {site_url}: {str(e)}")
         update_status(site_url, "error", "error", 0, str(e))
 
+async def run_locked_generation(config: GeneratorRequest, key: str, lock: asyncio.Lock):
+    """Run a generation while holding its per-URL lock, acquired by the caller"""
+    try:
+        await generate_llms_background(config)
+    finally:
+        lock.release()
+        _url_locks.pop(key, None)
+
 # API Endpoints
 
 @app.get("/")
@@ -380,11 +510,16 @@ async def start_generation(config: GeneratorRequest, background_tasks: Backgroun
     site_url = str(config.siteUrl)
     
     # Check if generation is already running
-    if site_url in generation_status and generation_status[site_url]["status"] == "running":
+    key = _status_key(site_url)
+    lock = _url_locks.setdefault(key, asyncio.Lock())
+    if lock.locked():
         return {"message": "Generation already in progress", "site_url": site_url}
     
+    # Acquire before scheduling so a second request can't slip in before the task starts
+    await lock.acquire()
+    
     # Start background task
-    background_tasks.add_task(generate_llms_background, config)
+    background_tasks.add_task(run_locked_generation, config, key, lock)
     
     update_status(site_url, "running", "start", 0, "Generation started")
     
@@ -397,20 +532,19 @@ async def start_generation(config: GeneratorRequest, background_tasks: Backgroun
 @app.get("/status/{site_url:path}", response_model=GenerationStatus)
 async def get_generation_status(site_url: str):
     """Get generation status for a specific URL"""
-    if site_url not in generation_status:
+    status = generation_status.get(_status_key(site_url))
+    if status is None:
         raise HTTPException(status_code=404, detail="Generation not found")
     
-    status = generation_status[site_url]
     return GenerationStatus(**status)
 
 @app.get("/result/{site_url:path}", response_model=GenerationResponse)
 async def get_generation_result(site_url: str):
     """Get the generated llms.txt content"""
-    if site_url not in generation_status:
+    status = generation_status.get(_status_key(site_url))
+    if status is None:
         raise HTTPException(status_code=404, detail="Generation not found")
     
-    status = generation_status[site_url]
-    
     if status["status"] != "completed":
         raise HTTPException(status_code=400, detail="Generation not completed yet")
     
@@ -426,8 +560,7 @@ async def get_generation_result(site_url: str):
 @app.delete("/generation/{site_url:path}")
 async def cancel_generation(site_url: str):
     """Cancel or clean up generation for a URL"""
-    if site_url in generation_status:
-        del generation_status[site_url]
+    if generation_status.pop(_status_key(site_url), None) is not None:
         return {"message": "Generation cancelled/cleaned up", "site_url": site_url}
     
     raise HTTPException(status_code=404, detail="Generation not found")